@@ -7,9 +7,73 @@ import threading
 import socket
 import signal
 import shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import collections
+import bisect
+import re
+import queue
+import operator
+import mmap
+import stat
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+# Minimal environment for slipstream-client processes
+CLIENT_ENV = {"PATH": os.environ.get("PATH", "/usr/bin:/bin")}
+
+# Most rows the right-hand SUCCESS panel keeps (more than any terminal shows)
+SUCCESS_PANEL_ROWS = 200
+
+# Plain HTTP endpoints fetched through the tunnel: (host, path)
+CONNECTIVITY_CHECK = ("www.gstatic.com", "/generate_204")
+SPEED_TEST_DOWNLOAD = ("speed.cloudflare.com", "/__down?bytes=102400")  # 100KB
+
+
+# Terminal control sequences (terminfo smcup/rmcup/civis/cnorm on xterm-compatible terminals)
+ENTER_ALT_SCREEN = '\033[?1049h'
+EXIT_ALT_SCREEN = '\033[?1049l'
+HIDE_CURSOR = '\033[?25l'
+SHOW_CURSOR = '\033[?25h'
+
+_ANSI_ESCAPE = re.compile(r'\033\[[0-9;]*m')
+
+
+def strip_ansi(s):
+    """Remove ANSI color codes from s."""
+    return _ANSI_ESCAPE.sub('', s)
+
+
+class ProbeError(Exception):
+    """
+    Raised when an HTTP request through the tunnel fails.
+    error_type is the category reported in the summary and error log.
+    """
+    def __init__(self, error_type, message=""):
+        super().__init__(message or error_type)
+        self.error_type = error_type
+
+
+def get_used_local_tcp_ports():
+    """
+    Read the TCP ports bound on 127.0.0.1 or 0.0.0.0 from /proc/net/tcp.
+    Returns a set of port numbers, or None if /proc/net/tcp is unavailable.
+    """
+    try:
+        with open('/proc/net/tcp') as f:
+            rows = f.read().splitlines()[1:]  # Skip the header row
+    except OSError:
+        return None
+
+    used_ports = set()
+    for row in rows:
+        fields = row.split()
+        if len(fields) < 2:
+            continue
+        # local_address is HEX_IP:HEX_PORT, e.g. 0100007F:DC29
+        ip_hex, _, port_hex = fields[1].partition(':')
+        if ip_hex in ('0100007F', '00000000'):
+            used_ports.add(int(port_hex, 16))
+    return used_ports
+
 
 def allocate_available_ports(base_port, num_ports):
     """
@@ -17,41 +81,39 @@ def allocate_available_ports(base_port, num_ports):
     Returns a list of available port numbers.
     Raises RuntimeError if not enough ports are available.
     """
-    allocated_ports = []
-    current_port = base_port
-
-    while len(allocated_ports) < num_ports:
-        if current_port > 65535:
-            raise RuntimeError(f"Not enough allocatable ports available. Only allocated {len(allocated_ports)} out of {num_ports} required ports.")
-
-        # Quick check if port is available
+    def is_port_free(port):
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.bind(('127.0.0.1', current_port))
-                allocated_ports.append(current_port)
+                s.bind(('127.0.0.1', port))
+                return True
         except OSError:
-            # Port is in use, try next one
-            pass
+            return False
 
-        current_port += 1
+    # Skip ports already known to be in use (if /proc/net/tcp is unavailable,
+    # every port is a candidate); the bind() still confirms each candidate in
+    # case the snapshot is stale
+    used_ports = get_used_local_tcp_ports() or set()
 
-    return allocated_ports
+    allocated_ports = []
+    for port in range(base_port, 65536):
+        if port not in used_ports and is_port_free(port):
+            allocated_ports.append(port)
+            if len(allocated_ports) == num_ports:
+                return allocated_ports
+
+    raise RuntimeError(f"Not enough allocatable ports available. Only allocated {len(allocated_ports)} out of {num_ports} required ports.")
 
 
-def progress_monitor(stop_event, completed_count, total_count, success_count, progress_lock,
+def progress_monitor(stop_event, completed_count, total_count, success_count,
                      start_time, recent_results, results_lock, successful_list):
     """
     Monitor progress with htop-like full-screen display.
     Uses alternate screen buffer for true full-screen like htop/vim.
     """
-    import re
-    import os
-
-    def strip_ansi(s):
-        return re.sub(r'\033\[[0-9;]*m', '', s)
-
     def pad(text, width):
         """Pad text to width, accounting for ANSI codes."""
+        if '\033' not in text:
+            return text.ljust(width)
         visible = len(strip_ansi(text))
         return text + ' ' * max(0, width - visible)
 
@@ -63,11 +125,19 @@ def progress_monitor(stop_event, completed_count, total_count, success_count, pr
     B = '\033[1m'    # Bold
     N = '\033[0m'    # Reset
 
-    # Enter alternate screen buffer (like htop, vim, less)
-    os.system('tput smcup 2>/dev/null || true')
-    os.system('tput civis 2>/dev/null || true')
+    # Enter alternate screen buffer (like htop, vim, less). The flush also
+    # drains any pending sys.stdout text before frames switch to os.write below,
+    # so the two output paths never interleave.
+    sys.stdout.write(ENTER_ALT_SCREEN + HIDE_CURSOR)
+    sys.stdout.flush()
+
+    last_lines = []  # Rows currently on screen, so only changed rows are redrawn
+    last_size = None
 
-    last_output = ""  # Track last output to avoid unnecessary redraws
+    # On a tty, write frames straight to the file descriptor instead of going
+    # through sys.stdout's text and buffer layers
+    tty_fd = sys.stdout.fileno() if sys.stdout.isatty() else None
+    frame_cache = {}  # Rows that only depend on the column widths, keyed by (W, LW, RW)
 
     try:
         while not stop_event.wait(0.3):
@@ -78,14 +148,28 @@ def progress_monitor(stop_event, completed_count, total_count, success_count, pr
             LW = W // 2 - 2
             RW = W - LW - 5
 
-            with progress_lock:
-                done = completed_count[0]
-                ok = success_count[0]
+            frame = frame_cache.get((W, LW, RW))
+            if frame is None:
+                border = f"{C}+{'-'*LW}+{N} {G}+{'-'*RW}+{N}"
+                left = pad(f" {B}SLIPSTREAM TUNNEL CHECKER{N}", LW)
+                right = pad(f" {B}SUCCESS (best first){N}", RW)
+                header = f"{C}|{N}{left}{C}|{N} {G}|{N}{right}{G}|{N}"
+                separator_left = f"{C}+{'-'*LW}+{N} "
+                recent_header = pad(f" {B}Recent Tests:{N}", LW)
+                frame = (border, header, separator_left, recent_header)
+                frame_cache[(W, LW, RW)] = frame
+            border, header, separator_left, recent_header = frame
+
+            # Counters are only written by the main thread, completed before
+            # success, so reading success first keeps ok <= done without a lock
+            ok = success_count[0]
+            done = completed_count[0]
             fail = done - ok
 
             with results_lock:
                 recent = list(recent_results)
-                succs = [e[2] for e in successful_list]
+                # Only the rows that fit on screen are ever shown
+                succs = [e[2] for e in successful_list[:max(H, 10)]]
 
             elapsed = time.time() - start_time
             pct = (done / total_count * 100) if total_count > 0 else 0
@@ -103,15 +187,13 @@ def progress_monitor(stop_event, completed_count, total_count, success_count, pr
             lines = []
 
             # Top border
-            lines.append(f"{C}+{'-'*LW}+{N} {G}+{'-'*RW}+{N}")
+            lines.append(border)
 
             # Header row
-            left = pad(f" {B}SLIPSTREAM TUNNEL CHECKER{N}", LW)
-            right = pad(f" {B}SUCCESS (best first){N}", RW)
-            lines.append(f"{C}|{N}{left}{C}|{N} {G}|{N}{right}{G}|{N}")
+            lines.append(header)
 
             # Header separator
-            lines.append(f"{C}+{'-'*LW}+{N} {G}+{'-'*RW}+{N}")
+            lines.append(border)
 
             # Progress row
             left = pad(f" [{bar}] {pct:5.1f}%", LW)
@@ -130,10 +212,10 @@ def progress_monitor(stop_event, completed_count, total_count, success_count, pr
 
             # Separator
             right = pad(f" {succs[3][:RW-2]}" if len(succs) > 3 else "", RW)
-            lines.append(f"{C}+{'-'*LW}+{N} {G}|{N}{right}{G}|{N}")
+            lines.append(f"{separator_left}{G}|{N}{right}{G}|{N}")
 
             # Recent header
-            left = pad(f" {B}Recent Tests:{N}", LW)
+            left = recent_header
             right = pad(f" {succs[4][:RW-2]}" if len(succs) > 4 else "", RW)
             lines.append(f"{C}|{N}{left}{C}|{N} {G}|{N}{right}{G}|{N}")
 
@@ -162,46 +244,62 @@ def progress_monitor(stop_event, completed_count, total_count, success_count, pr
                 lines.append(f"{C}|{N}{left}{C}|{N} {G}|{N}{right}{G}|{N}")
 
             # Bottom border
-            lines.append(f"{C}+{'-'*LW}+{N} {G}+{'-'*RW}+{N}")
-
-            # Only redraw if content changed (prevents flickering and selection reset)
-            output = '\n'.join(line + '\033[K' for line in lines)
-            if output != last_output:
-                sys.stdout.write('\033[H')
-                sys.stdout.write(output)
-                sys.stdout.flush()
-                last_output = output
+            lines.append(border)
+
+            # Start from a blank screen whenever the terminal is resized
+            out = []
+            if (W, H) != last_size:
+                out.append('\033[2J')
+                last_lines = []
+                last_size = (W, H)
+
+            # Only redraw rows that changed (prevents flickering and selection reset)
+            for i, line in enumerate(lines):
+                if i >= len(last_lines) or last_lines[i] != line:
+                    out.append(f'\033[{i+1};1H{line}\033[K')
+            if out:
+                if tty_fd is not None:
+                    data = memoryview(''.join(out).encode('utf-8'))
+                    while data:
+                        data = data[os.write(tty_fd, data):]  # Handle short writes
+                else:
+                    sys.stdout.write(''.join(out))
+                    sys.stdout.flush()
+            last_lines = lines
 
     finally:
-        os.system('tput cnorm 2>/dev/null || true')
-        os.system('tput rmcup 2>/dev/null || true')
+        sys.stdout.write(SHOW_CURSOR + EXIT_ALT_SCREEN)
+        sys.stdout.flush()
 
 
-def setup_signal_handler(stop_event, all_processes, process_lock, process_timeout, htop_mode=False):
+def setup_signal_handler(stop_event, all_processes, process_timeout, htop_mode=False):
     """
     Set up signal handler for graceful shutdown on Ctrl+C.
     """
     def signal_handler(signum, frame):
-        # Restore terminal if in htop mode
+        # Restore terminal if in htop mode. Write to the fd directly so the
+        # handler neither forks nor re-enters sys.stdout's buffer.
         if htop_mode:
-            os.system('tput cnorm 2>/dev/null || true')  # Show cursor
-            os.system('tput rmcup 2>/dev/null || true')  # Exit alt screen
+            try:
+                os.write(sys.stdout.fileno(), (SHOW_CURSOR + EXIT_ALT_SCREEN).encode())
+            except OSError:
+                pass
 
         print("\n\nInterrupted! Cleaning up...")
         stop_event.set()
 
-        # Terminate all running slipstream-client processes
-        with process_lock:
-            for proc in all_processes:
-                if proc and proc.poll() is None:
+        # Terminate all running slipstream-client processes (iterate over a
+        # snapshot, since workers keep adding and discarding entries)
+        for proc in list(all_processes):
+            if proc and proc.poll() is None:
+                try:
+                    proc.terminate()
+                    proc.wait(timeout=process_timeout)
+                except:
                     try:
-                        proc.terminate()
-                        proc.wait(timeout=process_timeout)
+                        proc.kill()
                     except:
-                        try:
-                            proc.kill()
-                        except:
-                            pass
+                        pass
 
         print("Cleanup complete. Exiting...")
         sys.exit(130)  # Exit code 130 indicates SIGINT termination
@@ -210,43 +308,143 @@ def setup_signal_handler(stop_event, all_processes, process_lock, process_timeou
     signal.signal(signal.SIGTERM, signal_handler)
 
 
+def _remaining(deadline):
+    """Seconds left until deadline; raises socket.timeout once it has passed."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout("request timed out")
+    return remaining
+
+
+def _recv_exact(sock, size, deadline):
+    """Read exactly size bytes from sock or raise ProbeError if it closes early."""
+    data = b''
+    while len(data) < size:
+        sock.settimeout(_remaining(deadline))
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ProbeError("proxy_error", "SOCKS5 proxy closed the connection")
+        data += chunk
+    return data
+
+
+def http_get_via_socks5(listen_port, host, path, timeout):
+    """
+    Make a plain HTTP GET for host/path through the SOCKS5 proxy on listen_port.
+    timeout bounds the whole request, like curl's --max-time.
+    Returns (response_head, body_size). Raises ProbeError on failure.
+    """
+    deadline = time.monotonic() + timeout
+
+    try:
+        with socket.create_connection(('127.0.0.1', listen_port), timeout=_remaining(deadline)) as s:
+            # Greeting: version 5, one method, no authentication
+            s.settimeout(_remaining(deadline))
+            s.sendall(b'\x05\x01\x00')
+            if _recv_exact(s, 2, deadline) != b'\x05\x00':
+                raise ProbeError("proxy_error", "SOCKS5 greeting rejected")
+
+            # CONNECT to host:80 by domain name
+            name = host.encode('idna')
+            s.settimeout(_remaining(deadline))
+            s.sendall(b'\x05\x01\x00\x03' + bytes([len(name)]) + name + (80).to_bytes(2, 'big'))
+            reply = _recv_exact(s, 4, deadline)
+            if reply[1] != 0x00:
+                raise ProbeError("proxy_error", f"SOCKS5 CONNECT failed (code {reply[1]})")
+
+            # Skip the bound address (IPv4, domain or IPv6) and port
+            if reply[3] == 0x01:
+                _recv_exact(s, 4 + 2, deadline)
+            elif reply[3] == 0x03:
+                _recv_exact(s, _recv_exact(s, 1, deadline)[0] + 2, deadline)
+            else:
+                _recv_exact(s, 16 + 2, deadline)
+
+            # HTTP/1.0 keeps the response unchunked and closes when done
+            request = f"GET {path} HTTP/1.0\r\nHost: {host}\r\nConnection: close\r\n\r\n"
+            s.settimeout(_remaining(deadline))
+            s.sendall(request.encode('ascii'))
+
+            response = bytearray()
+            while True:
+                s.settimeout(_remaining(deadline))
+                chunk = s.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+
+    except socket.timeout:
+        raise ProbeError("curl_timeout", "request timed out")
+    except ConnectionRefusedError:
+        raise ProbeError("connection_refused", "SOCKS5 port refused the connection")
+    except OSError as e:
+        raise ProbeError("request_failed", str(e))
+
+    if not response.startswith(b'HTTP/'):
+        raise ProbeError("request_failed", "empty or malformed HTTP response")
+
+    head, _, body = bytes(response).partition(b'\r\n\r\n')
+    return head.decode('latin-1'), len(body)
+
+
+def wait_for_socks5_ready(listen_port, timeout, client_process, stop_event):
+    """
+    Poll the SOCKS5 port of slipstream-client until it accepts a greeting.
+    slipstream-client only starts listening once its QUIC tunnel is up, so this
+    returns as soon as the tunnel is usable instead of sleeping the full timeout.
+    Returns True if ready, False on timeout, client exit or shutdown.
+    """
+    deadline = time.monotonic() + timeout
+    backoff = 0.05
+
+    while True:
+        if client_process.poll() is not None or stop_event.is_set():
+            return False
+
+        try:
+            with socket.create_connection(('127.0.0.1', listen_port), timeout=0.25) as s:
+                s.sendall(b'\x05\x01\x00')
+                if s.recv(2) == b'\x05\x00':
+                    return True
+        except OSError:
+            pass  # Not listening yet
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        stop_event.wait(min(backoff, remaining))
+        backoff = min(backoff * 2, 1.0)
+
+
 def run_speed_test(listen_port, curl_timeout, verbose):
     """
     Run a speed test by downloading a 100KB file.
     Returns speed in KB/sec or None if failed.
     """
-    speed_test_url = "http://speed.cloudflare.com/__down?bytes=102400"  # 100KB
-    curl_command = [
-        "curl",
-        "-s",
-        "--max-time", str(curl_timeout),
-        "-o", "/dev/null",
-        "-w", "%{speed_download}",
-        "--proxy", f"socks5://127.0.0.1:{listen_port}",
-        speed_test_url
-    ]
-
+    start = time.monotonic()
     try:
-        result = subprocess.run(curl_command, capture_output=True, text=True, check=False)
-        if result.returncode == 0:
-            speed_bytes = float(result.stdout.strip())
-            speed_kbps = speed_bytes / 1024
-            return speed_kbps
-    except:
-        pass
+        _, body_size = http_get_via_socks5(listen_port, *SPEED_TEST_DOWNLOAD, curl_timeout)
+    except ProbeError:
+        return None
+
+    elapsed = time.monotonic() - start
+    if body_size and elapsed > 0:
+        return body_size / 1024 / elapsed
     return None
 
 
-def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string, curl_timeout,
-                          client_executable, successful_results, results_lock,
+def test_single_dns_server(server_info, worker_slot, curl_timeout,
+                          successful_results, results_lock,
                           error_summary, error_lock, verbose, error_log_file,
-                          error_log_lock, process_timeout, stop_event, all_processes, process_lock,
+                          error_log_lock, process_timeout, stop_event, all_processes,
                           startup_wait, max_retries, speed_test, recent_results, htop_mode=False,
-                          successful_list=None, output_file=None):
+                          successful_list=None, output_file=None, output_fh=None):
     """
-    Test a single DNS server by starting slipstream-client and making a curl request.
+    Test a single DNS server by starting slipstream-client and making an HTTP request through it.
     Returns True if successful, False otherwise.
     Supports retry logic and optional speed testing.
+    worker_slot holds the calling worker thread's SOCKS5 port and prebuilt
+    slipstream-client command (see run_slipstream_client_and_curl).
     """
     # Check if interrupted before starting
     if stop_event.is_set():
@@ -272,6 +470,10 @@ def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string,
             error_summary['unsupported_protocol'] = error_summary.get('unsupported_protocol', 0) + 1
         return False
 
+    # Build slipstream-client command from this worker's template
+    listen_port = worker_slot.listen_port
+    client_command = worker_slot.client_command + [f"{address}:{port}"]
+
     # Retry loop
     for attempt in range(max_retries + 1):
         if stop_event.is_set():
@@ -281,35 +483,31 @@ def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string,
             retry_str = f" (retry {attempt})" if attempt > 0 else ""
             print(f"\n--- Testing UDP resolver: {address}:{port}{retry_str} ---")
 
-        # Build slipstream-client command
-        client_command = [
-            client_executable,
-            "--domain", domain_string,
-            "--resolver", f"{address}:{port}",
-            "--listen", f"127.0.0.1:{listen_port}",
-            "--pubkey-file", pubkey_file,
-            "--log-level", "error"  # Reduce noise during testing
-        ]
-
         client_process = None
         error_type = None
         success = False
 
         try:
-            # Start slipstream-client in a non-blocking way
+            # Start slipstream-client in a non-blocking way. Without close_fds,
+            # start_new_session or preexec_fn, subprocess can use posix_spawn
+            # instead of fork+exec; Python's own fds are non-inheritable anyway.
             client_process = subprocess.Popen(
                 client_command,
-                stdout=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
-                text=True
+                text=True,
+                env=CLIENT_ENV,
+                close_fds=False
             )
 
-            # Track process for cleanup
-            with process_lock:
-                all_processes.append(client_process)
+            # Track process for cleanup (single set operations are atomic under the GIL)
+            all_processes.add(client_process)
 
-            # Give slipstream-client time to establish QUIC tunnel
-            time.sleep(startup_wait)
+            # Give slipstream-client up to startup_wait to establish the QUIC tunnel,
+            # moving on as soon as its SOCKS5 port answers
+            wait_for_socks5_ready(listen_port, startup_wait, client_process, stop_event)
+            if stop_event.is_set():
+                break
 
             # Check if process is still running
             if client_process.poll() is not None:
@@ -323,26 +521,21 @@ def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string,
                 print("Making connectivity test...")
 
             # Connectivity test
-            curl_command = [
-                "curl",
-                "-s",
-                "--max-time", str(curl_timeout),
-                "-i",
-                "--proxy", f"socks5://127.0.0.1:{listen_port}",
-                "http://www.gstatic.com/generate_204"
-            ]
-
-            curl_start_time = time.time()
-            curl_result = subprocess.run(curl_command, capture_output=True, text=True, check=False)
-            curl_elapsed_time = time.time() - curl_start_time
+            curl_start_time = time.monotonic()
+            try:
+                response_head, _ = http_get_via_socks5(listen_port, *CONNECTIVITY_CHECK, curl_timeout)
+                probe_error = None
+            except ProbeError as e:
+                response_head = str(e)
+                probe_error = e
+            curl_elapsed_time = time.monotonic() - curl_start_time
 
             if verbose:
-                print("\n----- Curl Output -----")
-                print(curl_result.stdout)
-                print(curl_result.stderr)
-                print("-----------------------")
+                print("\n----- HTTP Response -----")
+                print(response_head)
+                print("-------------------------")
 
-            if curl_result.returncode == 0:
+            if probe_error is None:
                 # Connectivity test passed
                 speed_kbps = None
 
@@ -370,31 +563,32 @@ def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string,
                 with results_lock:
                     successful_results.append((protocol, address, port, curl_elapsed_time, speed_kbps))
                     recent_results.append(result_str)
-                    # Keep last 50 results for display
-                    while len(recent_results) > 50:
-                        recent_results.pop(0)
                     # Add to successful_list for right panel, sorted by best performance
                     if successful_list is not None:
                         # Always show both latency and speed (or N/A if no speed test)
+                        # Entries are (-speed, latency, label) so that plain tuple order
+                        # is highest speed first, then lowest latency
                         if speed_kbps:
-                            entry = (speed_kbps, curl_elapsed_time, f"{address}:{port} {curl_elapsed_time:.1f}s {speed_kbps:.0f}KB/s")
+                            entry = (-speed_kbps, curl_elapsed_time, f"{address}:{port} {curl_elapsed_time:.1f}s {speed_kbps:.0f}KB/s")
                         else:
                             entry = (0, curl_elapsed_time, f"{address}:{port} {curl_elapsed_time:.1f}s --KB/s")
-                        successful_list.append(entry)
-                        # Sort: highest speed first, then lowest latency
-                        successful_list.sort(key=lambda x: (-x[0], x[1]))
-
-                    # Write to output file immediately (real-time saving)
+                        # Keep only the best SUCCESS_PANEL_ROWS entries; anything
+                        # worse than the current last row could never be shown
+                        if len(successful_list) < SUCCESS_PANEL_ROWS:
+                            bisect.insort(successful_list, entry)
+                        elif entry < successful_list[-1]:
+                            bisect.insort(successful_list, entry)
+                            successful_list.pop()
+
+                    # Append to output file immediately (real-time saving);
+                    # the sorted file is written once at the end of the run.
+                    # The file is opened on the first success, so a run interrupted
+                    # before any success leaves an existing results file untouched.
                     if output_file:
                         try:
-                            with open(output_file, 'w') as f:
-                                for res in successful_results:
-                                    p, a, pt, lat = res[:4]
-                                    spd = res[4] if len(res) > 4 else None
-                                    if spd is not None:
-                                        f.write(f"{p}: {a}:{pt} {lat:.2f}s {spd:.1f}KB/s\n")
-                                    else:
-                                        f.write(f"{p}: {a}:{pt} {lat:.2f}s\n")
+                            if output_fh[0] is None:
+                                output_fh[0] = open(output_file, 'w', buffering=1)
+                            output_fh[0].write(format_result_line(successful_results[-1]))
                         except:
                             pass  # Ignore write errors in background
 
@@ -402,35 +596,19 @@ def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string,
                 break  # Success, no need to retry
 
             else:
-                # Categorize the error
-                if curl_result.returncode == 28:
-                    error_type = "curl_timeout"
-                elif "Connection refused" in curl_result.stderr or "Failed to connect" in curl_result.stderr:
-                    error_type = "connection_refused"
-                elif "Could not resolve proxy" in curl_result.stderr:
-                    error_type = "proxy_error"
-                else:
-                    error_type = f"curl_failed_code_{curl_result.returncode}"
+                error_type = probe_error.error_type
 
                 if verbose:
                     print(f"{RED}FAILED: {address}:{port} - {error_type}{RESET}")
 
-        except FileNotFoundError:
-            error_type = "curl_not_found"
-            if verbose:
-                print("Error: 'curl' command not found.")
         except Exception as e:
             error_type = "exception"
             if verbose:
                 print(f"Error: {e}")
         finally:
             if client_process:
-                # Remove from tracking list
-                with process_lock:
-                    try:
-                        all_processes.remove(client_process)
-                    except ValueError:
-                        pass
+                # Remove from tracking set
+                all_processes.discard(client_process)
 
                 # Terminate if still running
                 if client_process.poll() is None:
@@ -446,7 +624,7 @@ def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string,
         if attempt < max_retries and not success:
             if verbose:
                 print(f"{YELLOW}Retrying in 2 seconds...{RESET}")
-            time.sleep(2)
+            stop_event.wait(2)
 
     # Update error summary if all attempts failed
     if not success and error_type:
@@ -457,8 +635,6 @@ def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string,
         with results_lock:
             fail_str = f"\033[91m✗\033[0m {protocol}: {address}:{port} {error_type}"
             recent_results.append(fail_str)
-            while len(recent_results) > 50:
-                recent_results.pop(0)
 
         # Write to error log if specified
         if error_log_file:
@@ -473,6 +649,17 @@ def test_single_dns_server(server_info, listen_port, pubkey_file, domain_string,
     return success
 
 
+def format_result_line(result):
+    """
+    Format a successful result tuple as a line of the output file.
+    """
+    protocol, address, port, latency = result[:4]
+    speed_kbps = result[4] if len(result) > 4 else None
+    if speed_kbps is not None:
+        return f"{protocol}: {address}:{port} {latency:.2f}s {speed_kbps:.1f}KB/s\n"
+    return f"{protocol}: {address}:{port} {latency:.2f}s\n"
+
+
 def print_summary(total_count, success_count, error_summary, error_log_file, successful_results, speed_test):
     """
     Print a summary of the test results.
@@ -509,11 +696,30 @@ def print_summary(total_count, success_count, error_summary, error_log_file, suc
     print("="*60)
 
 
+def _iter_lines(f):
+    """
+    Yield the raw lines of binary file f, through mmap when it is a non-empty
+    regular file. Pipes, FIFOs, empty files and files mmap refuses are read
+    from the handle directly.
+    """
+    st = os.fstat(f.fileno())
+    if stat.S_ISREG(st.st_mode) and st.st_size:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            pass
+        else:
+            with mm:
+                yield from iter(mm.readline, b'')
+            return
+    yield from f
+
+
 def run_slipstream_client_and_curl(dns_servers_file, pubkey_file, domain_string, listen_port,
                                     curl_timeout, output_file, workers, verbose, error_log_file,
                                     process_timeout, startup_wait, max_retries, speed_test):
     """
-    Loops through DNS servers, starts slipstream-client, and makes a curl request.
+    Loops through DNS servers, starts slipstream-client, and makes an HTTP request through it.
     Supports multi-threaded execution for faster testing.
     """
     client_executable = os.path.join(os.path.dirname(__file__), "slipstream-client")
@@ -529,30 +735,27 @@ def run_slipstream_client_and_curl(dns_servers_file, pubkey_file, domain_string,
 
     # Read and parse DNS servers
     try:
-        with open(dns_servers_file, 'r') as f:
-            dns_servers = []
-            for line in f:
+        dns_servers = []
+        malformed_count = 0
+        malformed_lines = []  # First 20 (line number, raw line), reported once after parsing
+        with open(dns_servers_file, 'rb') as f:
+            # Walk the file as raw bytes lines; only parsed fields are decoded
+            for lineno, line in enumerate(_iter_lines(f), 1):
                 line = line.strip()
-                if not line or line.startswith('#'):
+                # Blank lines and comments are skipped silently
+                if not line or line.startswith(b'#'):
                     continue
-                # Parse format: protocol: address:port
-                if ':' in line:
-                    parts = line.split(':', 1)
-                    if len(parts) == 2:
-                        protocol = parts[0].strip().upper()
-                        server_part = parts[1].strip()
-                        # server_part is "address:port"
-                        if ':' in server_part:
-                            address, port = server_part.rsplit(':', 1)
-                            try:
-                                port = int(port)
-                                dns_servers.append((protocol, address, port))
-                            except ValueError:
-                                print(f"Warning: Invalid port in line: {line}")
-                        else:
-                            print(f"Warning: Invalid format in line: {line}")
+                # "protocol: address:port"; the address is everything up to
+                # the last colon, so IPv6 addresses are accepted as-is
+                protocol, _, rest = line.partition(b':')
+                address, _, port = rest.rpartition(b':')
+                protocol, address, port = protocol.strip(), address.strip(), port.strip()
+                if protocol and address and port.isdigit():
+                    dns_servers.append((protocol.decode().upper(), address.decode(), int(port)))
                 else:
-                    print(f"Warning: Invalid format in line: {line}")
+                    malformed_count += 1
+                    if len(malformed_lines) < 20:
+                        malformed_lines.append((lineno, line))
     except FileNotFoundError:
         print(f"Error: DNS servers file not found at {dns_servers_file}")
         return
@@ -560,6 +763,14 @@ def run_slipstream_client_and_curl(dns_servers_file, pubkey_file, domain_string,
         print(f"Error reading DNS servers file: {e}")
         return
 
+    if malformed_lines:
+        lineno, line = malformed_lines[0]
+        print(f"Warning: Skipped {malformed_count} malformed lines "
+              f"(first: line {lineno}: {line.decode(errors='replace')})")
+        if verbose:
+            for lineno, line in malformed_lines:
+                print(f"  line {lineno}: {line.decode(errors='replace')}")
+
     if not dns_servers:
         print("No DNS servers found in the file.")
         return
@@ -589,22 +800,41 @@ def run_slipstream_client_and_curl(dns_servers_file, pubkey_file, domain_string,
     # Initialize shared state
     results_lock = threading.Lock()
     error_lock = threading.Lock()
-    progress_lock = threading.Lock()
-    process_lock = threading.Lock()
     error_log_lock = threading.Lock()
 
     completed_count = [0]  # Use list to make it mutable in nested scope
     success_count = [0]
     error_summary = {}
-    all_processes = []
+    all_processes = set()
     successful_results = []  # Store results for sorting by latency
-    recent_results = []  # Store recent results for display
-    successful_list = []  # Store successful IPs for right panel display
+    recent_results = collections.deque(maxlen=50)  # Last 50 results for display
+    successful_list = []  # Best successful IPs for right panel display (top SUCCESS_PANEL_ROWS)
 
     # Set up signal handler for graceful shutdown
     stop_event = threading.Event()
     htop_mode = workers > 1
-    setup_signal_handler(stop_event, all_processes, process_lock, process_timeout, htop_mode)
+    setup_signal_handler(stop_event, all_processes, process_timeout, htop_mode)
+
+    # Real-time output file handle, opened by the first success (line buffered)
+    output_fh = [None]
+
+    # Each worker thread owns one port for its lifetime, so no two tests ever
+    # share a SOCKS5 port. The slipstream-client command for that port is built
+    # once; tests only append their resolver.
+    free_slots = queue.SimpleQueue()
+    for assigned_port in allocated_ports:
+        free_slots.put((assigned_port, [
+            client_executable,
+            "--domain", domain_string,
+            "--listen", f"127.0.0.1:{assigned_port}",
+            "--pubkey-file", pubkey_file,
+            "--log-level", "error",  # Reduce noise during testing
+            "--resolvers",
+        ]))
+    worker_slot = threading.local()
+
+    def claim_worker_slot():
+        worker_slot.listen_port, worker_slot.client_command = free_slots.get_nowait()
 
     # Record start time for ETA calculation
     start_time = time.time()
@@ -614,32 +844,29 @@ def run_slipstream_client_and_curl(dns_servers_file, pubkey_file, domain_string,
     if workers > 1:
         progress_thread = threading.Thread(
             target=progress_monitor,
-            args=(stop_event, completed_count, total_count, success_count, progress_lock,
+            args=(stop_event, completed_count, total_count, success_count,
                   start_time, recent_results, results_lock, successful_list),
             daemon=True
         )
         progress_thread.start()
 
     # Use ThreadPoolExecutor for concurrent testing
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        # Submit all tasks
+    with ThreadPoolExecutor(max_workers=workers, initializer=claim_worker_slot) as executor:
+        # Submit all tasks; each future posts itself to result_queue when done
         future_to_server = {}
-        for idx, server_info in enumerate(udp_servers):
+        result_queue = queue.SimpleQueue()
+        for server_info in udp_servers:
             # Check if interrupted before submitting more tasks
             if stop_event.is_set():
                 break
 
-            assigned_port = allocated_ports[idx % workers]
             # htop_mode=True when workers > 1 to suppress verbose output
             htop_mode = workers > 1
             future = executor.submit(
                 test_single_dns_server,
                 server_info,
-                assigned_port,
-                pubkey_file,
-                domain_string,
+                worker_slot,
                 curl_timeout,
-                client_executable,
                 successful_results,
                 results_lock,
                 error_summary,
@@ -650,31 +877,31 @@ def run_slipstream_client_and_curl(dns_servers_file, pubkey_file, domain_string,
                 process_timeout,
                 stop_event,
                 all_processes,
-                process_lock,
                 startup_wait,
                 max_retries,
                 speed_test,
                 recent_results,
                 htop_mode,
                 successful_list,
-                output_file
+                output_file,
+                output_fh
             )
             future_to_server[future] = server_info
+            future.add_done_callback(result_queue.put)
 
-        # Process completed tasks
-        for future in as_completed(future_to_server):
+        # Process completed tasks in completion order
+        for _ in range(len(future_to_server)):
+            future = result_queue.get()
             if stop_event.is_set():
                 break
 
             try:
                 success = future.result()
-                with progress_lock:
-                    completed_count[0] += 1
-                    if success:
-                        success_count[0] += 1
+                completed_count[0] += 1
+                if success:
+                    success_count[0] += 1
             except Exception as e:
-                with progress_lock:
-                    completed_count[0] += 1
+                completed_count[0] += 1
                 if verbose:
                     server_info = future_to_server[future]
                     print(f"Exception occurred while testing {server_info}: {e}")
@@ -691,17 +918,14 @@ def run_slipstream_client_and_curl(dns_servers_file, pubkey_file, domain_string,
         # Sort by speed (highest first), with None values at the end
         successful_results.sort(key=lambda x: x[4] if x[4] is not None else 0, reverse=True)
     else:
-        successful_results.sort(key=lambda x: x[3])  # Sort by curl_elapsed_time
+        successful_results.sort(key=operator.itemgetter(3))  # Sort by curl_elapsed_time
+
+    if output_fh[0]:
+        output_fh[0].close()
 
     try:
         with open(output_file, 'w') as f:
-            for result in successful_results:
-                protocol, address, port, latency = result[:4]
-                speed_kbps = result[4] if len(result) > 4 else None
-                if speed_kbps is not None:
-                    f.write(f"{protocol}: {address}:{port} {latency:.2f}s {speed_kbps:.1f}KB/s\n")
-                else:
-                    f.write(f"{protocol}: {address}:{port} {latency:.2f}s\n")
+            f.writelines(format_result_line(result) for result in successful_results)
         sort_type = "highest speed" if speed_test else "lowest latency"
         print(f"\nResults written to {output_file} (sorted by {sort_type})")
     except Exception as e:
@@ -737,7 +961,7 @@ def main():
         "--curl_timeout",
         type=int,
         default=30,
-        help="The curl request timeout in seconds (default: 30)."
+        help="The HTTP probe timeout in seconds (default: 30)."
     )
     parser.add_argument(
         "--output",
@@ -773,7 +997,7 @@ def main():
         "--startup-wait",
         type=int,
         default=5,
-        help="Seconds to wait for QUIC tunnel establishment before testing (default: 5)."
+        help="Maximum seconds to wait for QUIC tunnel establishment before testing (default: 5)."
     )
     parser.add_argument(
         "--retries",